@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""evaluation.py
+
+Évaluation hors ligne du moteur de recommandation : qualité (precision@k,
+recall@k, MAP, couverture) et coût (entraînement, latence, mémoire)
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from recommandation import (
+    DATA_DIR,
+    MIN_PRODUCT_PURCHASES,
+    MIN_USER_ORDERS,
+    N_NEIGHBORS,
+    PRECOMPUTE_BATCH_SIZE,
+    SAMPLE_SIZE,
+    TOP_N,
+    column_aisles,
+    filter_active,
+    fit_collaborative_model,
+    load_raw_data,
+    prepare_sparse_matrix,
+    recommend_row,
+    top_n_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+# Paramètres par défaut d'un moteur; chaque configuration n'indique que ce qui change
+DEFAULT_ENGINE = {
+    'sample_size': SAMPLE_SIZE,
+    'min_product_purchases': MIN_PRODUCT_PURCHASES,
+    'min_user_orders': MIN_USER_ORDERS,
+    'n_neighbors': N_NEIGHBORS,
+    'diversify': True,
+}
+
+ENGINES = {
+    'baseline': {},
+    'knn_10': {'n_neighbors': 10},
+    'knn_40': {'n_neighbors': 40},
+    'no_diversification': {'diversify': False},
+    'min_purchases_10': {'min_product_purchases': 10},
+    'sample_0.05': {'sample_size': 0.05},
+    'sample_0.2': {'sample_size': 0.2},
+}
+
+HOLDOUT_MODES = ('last_order', 'train')
+LATENCY_SAMPLE_SIZE = 200  # Requêtes unitaires chronométrées par moteur
+
+
+def split_last_order(data):
+    """Sépare la dernière commande de chaque utilisateur (holdout) du reste (entraînement)"""
+    last_order = data.groupby('user_id')['order_number'].transform('max')
+    is_holdout = data['order_number'] == last_order
+    return data[~is_holdout].copy(), data[is_holdout]
+
+
+def load_train_holdout(dataset_path):
+    """Commandes du jeu 'train' d'Instacart, utilisées comme holdout"""
+    orders = pd.read_csv(os.path.join(dataset_path, 'orders.csv'),
+                         usecols=['order_id', 'user_id', 'eval_set'],
+                         dtype={'order_id': 'int32', 'user_id': 'int32'})
+    order_products = pd.read_csv(os.path.join(dataset_path, 'order_products__train.csv'),
+                                 usecols=['order_id', 'product_id'],
+                                 dtype={'order_id': 'int32', 'product_id': 'int32'})
+    return order_products.merge(orders[orders['eval_set'] == 'train'], on='order_id')
+
+
+def holdout_matrix(holdout, user_map, product_map):
+    """Matrice binaire holdout (utilisateurs évalués x produits) et nombre de produits pertinents"""
+    user_rows = user_map.positions(holdout['user_id'].to_numpy())
+    known_user = user_rows >= 0
+    holdout = holdout[known_user]
+    user_rows = user_rows[known_user]
+
+    # Les produits absents de l'entraînement restent pertinents mais ne sont jamais recommandables
+    eval_rows, eval_index = np.unique(user_rows, return_inverse=True)
+    n_relevant = np.bincount(
+        eval_index[~holdout.duplicated(['user_id', 'product_id']).to_numpy()],
+        minlength=len(eval_rows))
+
+    columns = product_map.positions(holdout['product_id'].to_numpy())
+    known_product = columns >= 0
+    matrix = csr_matrix(
+        (np.ones(known_product.sum(), dtype=np.int8), (eval_index[known_product], columns[known_product])),
+        shape=(len(eval_rows), len(product_map)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return eval_rows, matrix, n_relevant
+
+
+def ranking_metrics(recommended, relevant, n_relevant, n_products):
+    """precision@k, recall@k, MAP@k et couverture, calculés sur tout le lot à la fois"""
+    n_users, k = recommended.shape
+    valid = recommended >= 0
+
+    # Un seul accès sparse pour toutes les paires (utilisateur, recommandation)
+    rows = np.repeat(np.arange(n_users), k)
+    hits = np.asarray(relevant[rows, np.maximum(recommended, 0).ravel()]).reshape(n_users, k) > 0
+    hits &= valid
+
+    n_hits = hits.sum(axis=1)
+    precision_at_rank = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    average_precision = (precision_at_rank * hits).sum(axis=1) / np.minimum(n_relevant, k)
+
+    return {
+        'precision_at_k': float(np.mean(n_hits / k)),
+        'recall_at_k': float(np.mean(n_hits / n_relevant)),
+        'map_at_k': float(np.mean(average_precision)),
+        'coverage': float(np.unique(recommended[valid]).size / n_products),
+    }
+
+
+def train_engine(train_data, engine):
+    """Construit la matrice et le modèle collaboratif d'un moteur"""
+    matrix, user_map, product_map = prepare_sparse_matrix(train_data.copy())
+    cf_model = fit_collaborative_model(matrix, n_neighbors=min(engine['n_neighbors'], matrix.shape[0]))
+    return matrix, user_map, product_map, cf_model
+
+
+def single_user_latencies(sample_rows, cf_model, matrix, column_ids, aisles, product_index, k, diversify):
+    """Latence (ms) de requêtes unitaires sur le chemin en ligne de l'API"""
+    latencies = np.empty(len(sample_rows))
+    for i, row in enumerate(sample_rows):
+        started = time.perf_counter()
+        recommend_row(row, cf_model, matrix, column_ids, aisles, product_index, k, diversify=diversify)
+        latencies[i] = 1000 * (time.perf_counter() - started)
+    return latencies
+
+
+def evaluate_engine(train_data, holdout, product_info, engine, k=TOP_N, batch_size=PRECOMPUTE_BATCH_SIZE,
+                    latency_sample_size=LATENCY_SAMPLE_SIZE):
+    """Entraîne un moteur, recommande pour tous les utilisateurs évalués et mesure qualité et coût"""
+    # Entraînement chronométré sans instrumentation
+    started = time.perf_counter()
+    matrix, user_map, product_map, cf_model = train_engine(train_data, engine)
+    training_time = time.perf_counter() - started
+
+    # Second entraînement sous tracemalloc (qui ralentit chaque allocation) pour le pic mémoire seul
+    tracemalloc.start()
+    train_engine(train_data, engine)
+    _, training_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    eval_rows, relevant, n_relevant = holdout_matrix(holdout, user_map, product_map)
+    column_ids = np.asarray(product_map.ids)
+    product_index = product_info.set_index('product_id')
+    aisles = column_aisles(column_ids, product_index)
+
+    # Recommandations par lots pour la qualité (débit amorti, pas une latence)
+    recommended = np.full((len(eval_rows), k), -1, dtype=np.int64)
+    started = time.perf_counter()
+    for start in range(0, len(eval_rows), batch_size):
+        batch = slice(start, start + batch_size)
+        recommended[batch], _ = top_n_columns(
+            eval_rows[batch], cf_model, matrix, aisles, k, diversify=engine['diversify'])
+    batch_time = time.perf_counter() - started
+
+    # Latence réelle: requêtes unitaires sur un échantillon fixe d'utilisateurs
+    rng = np.random.default_rng(0)
+    sample_rows = rng.choice(eval_rows, size=min(latency_sample_size, len(eval_rows)), replace=False)
+    latencies = single_user_latencies(
+        sample_rows, cf_model, matrix, column_ids, aisles, product_index, k, engine['diversify'])
+
+    model_bytes = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+                   + user_map.ids.nbytes + product_map.ids.nbytes)
+
+    return {
+        **ranking_metrics(recommended, relevant, n_relevant, matrix.shape[1]),
+        'users_evaluated': int(len(eval_rows)),
+        'training_time_s': round(training_time, 4),
+        'batch_ms_per_user': round(1000 * batch_time / max(len(eval_rows), 1), 4),
+        'query_latency_p50_ms': round(float(np.percentile(latencies, 50)), 4) if len(latencies) else None,
+        'query_latency_p95_ms': round(float(np.percentile(latencies, 95)), 4) if len(latencies) else None,
+        'training_peak_mb': round(training_peak / 2**20, 2),
+        'model_mb': round(model_bytes / 2**20, 2),
+    }
+
+
+def run_evaluation(dataset_path=DATA_DIR, engines=None, holdout_mode='last_order', k=TOP_N,
+                   batch_size=PRECOMPUTE_BATCH_SIZE):
+    """Évalue chaque moteur sur le même protocole de holdout"""
+    if holdout_mode not in HOLDOUT_MODES:
+        raise ValueError(f"Unknown holdout mode: {holdout_mode}")
+
+    engines = engines or ENGINES
+    train_holdout = load_train_holdout(dataset_path) if holdout_mode == 'train' else None
+    loaded = {}
+    results = []
+
+    for name, overrides in engines.items():
+        engine = {**DEFAULT_ENGINE, **overrides}
+        logger.info(f"Évaluation du moteur '{name}': {engine}")
+
+        # Les moteurs qui partagent le même échantillon réutilisent le même chargement
+        if engine['sample_size'] not in loaded:
+            data, product_info = load_raw_data(dataset_path, sample_size=engine['sample_size'])
+            if holdout_mode == 'last_order':
+                # Holdout séparé avant le filtrage d'activité: les achats retenus
+                # ne doivent pas décider quels utilisateurs/produits restent à l'entraînement
+                loaded[engine['sample_size']] = (*split_last_order(data), product_info)
+            else:
+                loaded[engine['sample_size']] = (data, train_holdout, product_info)
+        unfiltered, holdout, product_info = loaded[engine['sample_size']]
+        train_data = filter_active(unfiltered, min_product_purchases=engine['min_product_purchases'],
+                                   min_user_orders=engine['min_user_orders'])
+
+        metrics = evaluate_engine(train_data, holdout, product_info, engine, k=k, batch_size=batch_size)
+        results.append({'engine': name, 'holdout': holdout_mode, 'k': k, **engine, **metrics})
+        logger.info(f"Résultats '{name}': {metrics}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation hors ligne des moteurs de recommandation")
+    parser.add_argument('--data', default=DATA_DIR, help="Répertoire des CSV Instacart")
+    parser.add_argument('--holdout', choices=HOLDOUT_MODES, default='last_order')
+    parser.add_argument('--k', type=int, default=TOP_N)
+    parser.add_argument('--batch-size', type=int, default=PRECOMPUTE_BATCH_SIZE)
+    parser.add_argument('--engines', help="Moteurs à évaluer, séparés par des virgules (défaut: tous)")
+    parser.add_argument('--output', help="Fichier JSON où écrire les résultats")
+    args = parser.parse_args()
+
+    engines = ENGINES
+    if args.engines:
+        engines = {name: ENGINES[name] for name in args.engines.split(',')}
+
+    results = run_evaluation(args.data, engines, holdout_mode=args.holdout, k=args.k,
+                             batch_size=args.batch_size)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""id_mapping.py
+
+Correspondance compacte ID -> position adossée à un tableau int32 trié
+"""
+
+import operator
+import os
+import tempfile
+
+import numpy as np
+
+_INT32_MIN, _INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+
+def save_npy_atomic(path, array):
+    """np.save via un fichier temporaire renommé, pour ne pas tronquer un .npy memory-mappé ouvert"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.npy.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class IdMapping:
+    """Associe chaque ID à sa position dans un tableau trié (recherche par searchsorted)"""
+
+    def __init__(self, ids):
+        # ids: tableau int32 trié sans doublons (éventuellement memory-mappé)
+        self.ids = ids
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Construit la correspondance à partir d'IDs quelconques (doublons autorisés)"""
+        return cls(np.unique(np.asarray(ids, dtype=np.int32)))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Ouvre un tableau d'IDs sauvegardé par save(), memory-mappé par défaut"""
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    def save(self, path):
+        """Sauvegarde les IDs triés en .npy brut"""
+        save_npy_atomic(path, np.asarray(self.ids, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """Positions d'un lot d'IDs (vectorisé), -1 pour les IDs inconnus"""
+        ids = np.asarray(ids)
+        if ids.dtype == bool or len(self.ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+
+        ids = ids.astype(np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        clipped = np.minimum(positions, len(self.ids) - 1)
+        return np.where(self.ids[clipped] == ids, clipped, -1)
+
+    def position(self, id_):
+        """Position d'un ID, -1 s'il est inconnu ou n'est pas un entier (booléens exclus)"""
+        if isinstance(id_, (bool, np.bool_)):
+            return -1
+        try:
+            id_ = operator.index(id_)
+        except TypeError:
+            return -1
+        if not _INT32_MIN <= id_ <= _INT32_MAX:
+            return -1
+
+        position = int(np.searchsorted(self.ids, id_))
+        if position < len(self.ids) and self.ids[position] == id_:
+            return position
+        return -1
+
+    def __contains__(self, id_):
+        return self.position(id_) >= 0
+
+    def __getitem__(self, id_):
+        position = self.position(id_)
+        if position < 0:
+            raise KeyError(id_)
+        return position
@@ -21,26 +21,40 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import linear_kernel
 from joblib import dump, load
 from scipy.sparse import csr_matrix, save_npz, load_npz
+from functools import lru_cache
 import os
 import json
 import sys
 from datetime import datetime
 import logging
 
+from id_mapping import IdMapping, save_npy_atomic
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Constantes
 SAMPLE_SIZE = 0.1  # Fraction des données à utiliser
+# Lignes lues pour sample_size = 1 (mises à l'échelle par sample_size)
+SAMPLE_ORDERS_ROWS = int(1e7)
+SAMPLE_PRIOR_ROWS = int(3e7)
 MIN_PRODUCT_PURCHASES = 5  # Nombre minimum d'achats 
 MIN_USER_ORDERS = 3  # Nombre minimum de commandes 
+N_NEIGHBORS = 20  # Voisins du modèle collaboratif KNN
+TOP_N = 10  # Taille des recommandations précalculées par utilisateur
+PRECOMPUTE_BATCH_SIZE = 1024  # Utilisateurs traités par lot lors du précalcul
 DATA_DIR = 'data'
-MODEL_DIR = 'model'
+MODEL_DIR = os.environ.get('MODEL_DIR', 'model')
+TOP_N_PRODUCTS_FILE = 'top_n_products.npy'
+TOP_N_SCORES_FILE = 'top_n_scores.npy'
+TOP_N_USER_IDS_FILE = 'top_n_user_ids.npy'  # Empreinte: IDs utilisateurs des lignes de la table
+USER_IDS_FILE = 'user_ids.npy'
+PRODUCT_IDS_FILE = 'product_ids.npy'
 
-def load_sample_data(dataset_path):
-    """Charge un échantillon des données avec filtrage des utilisateurs/produits peu actifs"""
-    logger.info("Chargement des données avec échantillonnage...")
+def load_raw_data(dataset_path, sample_size=SAMPLE_SIZE):
+    """Charge un échantillon des commandes fusionnées, sans filtrage d'activité"""
+    logger.info(f"Chargement des données avec échantillonnage ({sample_size})...")
     
     try:
         # Chargement avec types optimisés
@@ -52,15 +66,15 @@ def load_sample_data(dataset_path):
             'reordered': 'int8'
         }
         
-        # Chargement partiel des données
+        # Chargement partiel des données, proportionnel à sample_size
         orders = pd.read_csv(os.path.join(dataset_path, 'orders.csv'), 
                           dtype={'order_id': 'int32', 'user_id': 'int32'},
-                          nrows=int(1e6) if SAMPLE_SIZE < 1.0 else None)
+                          nrows=int(SAMPLE_ORDERS_ROWS * sample_size) if sample_size < 1.0 else None)
         
         order_products = pd.read_csv(
             os.path.join(dataset_path, 'order_products__prior.csv'),
             dtype=dtype,
-            nrows=int(3e6) if SAMPLE_SIZE < 1.0 else None
+            nrows=int(SAMPLE_PRIOR_ROWS * sample_size) if sample_size < 1.0 else None
         )
         
         products = pd.read_csv(os.path.join(dataset_path, 'products.csv'),
@@ -73,50 +87,56 @@ def load_sample_data(dataset_path):
         merged = merged.merge(products, on='product_id')
         merged = merged.merge(aisles, on='aisle_id')
         
-        # Filtrage des utilisateurs et produits peu actifs
-        user_counts = merged['user_id'].value_counts()
-        active_users = user_counts[user_counts >= MIN_USER_ORDERS].index
-        
-        product_counts = merged['product_id'].value_counts()
-        active_products = product_counts[product_counts >= MIN_PRODUCT_PURCHASES].index
-        
-        filtered_data = merged[
-            (merged['user_id'].isin(active_users)) & 
-            (merged['product_id'].isin(active_products))
-        ]
-        
-        logger.info(f"Données filtrées: {len(filtered_data)} lignes "
-                   f"({len(active_users)} utilisateurs, {len(active_products)} produits)")
-        
-        return filtered_data, products.merge(aisles, on='aisle_id')
+        return merged, products.merge(aisles, on='aisle_id')
     
     except Exception as e:
         logger.error(f"Erreur lors du chargement: {str(e)}")
         raise
 
+def filter_active(data, min_product_purchases=MIN_PRODUCT_PURCHASES, min_user_orders=MIN_USER_ORDERS):
+    """Filtrage des utilisateurs et produits peu actifs"""
+    user_counts = data['user_id'].value_counts()
+    active_users = user_counts[user_counts >= min_user_orders].index
+    
+    product_counts = data['product_id'].value_counts()
+    active_products = product_counts[product_counts >= min_product_purchases].index
+    
+    filtered_data = data[
+        (data['user_id'].isin(active_users)) & 
+        (data['product_id'].isin(active_products))
+    ]
+    
+    logger.info(f"Données filtrées: {len(filtered_data)} lignes "
+               f"({len(active_users)} utilisateurs, {len(active_products)} produits)")
+    
+    return filtered_data
+
+def load_sample_data(dataset_path, sample_size=SAMPLE_SIZE,
+                     min_product_purchases=MIN_PRODUCT_PURCHASES, min_user_orders=MIN_USER_ORDERS):
+    """Charge un échantillon des données avec filtrage des utilisateurs/produits peu actifs"""
+    data, product_info = load_raw_data(dataset_path, sample_size)
+    return filter_active(data, min_product_purchases, min_user_orders), product_info
+
 def prepare_sparse_matrix(data):
     """Crée une matrice sparse utilisateur-produit optimisée"""
     logger.info("Préparation de la matrice sparse...")
     
     try:
-        # Création des mappings
-        user_ids = data['user_id'].unique()
-        product_ids = data['product_id'].unique()
-        
-        user_map = {u: i for i, u in enumerate(user_ids)}
-        product_map = {p: i for i, p in enumerate(product_ids)}
+        # Création des mappings (IDs triés -> position)
+        user_map = IdMapping.from_ids(data['user_id'].to_numpy())
+        product_map = IdMapping.from_ids(data['product_id'].to_numpy())
         
         # Pondération par réachat
         data['weight'] = data['reordered'].apply(lambda x: 1.5 if x else 1.0)
         
         # Construction de la matrice CSR directement pour économiser de la mémoire
-        row_ind = data['user_id'].map(user_map)
-        col_ind = data['product_id'].map(product_map)
+        row_ind = user_map.positions(data['user_id'].to_numpy())
+        col_ind = product_map.positions(data['product_id'].to_numpy())
         values = data['weight']
         
         matrix = csr_matrix(
             (values, (row_ind, col_ind)),
-            shape=(len(user_ids), len(product_ids)))
+            shape=(len(user_map), len(product_map)))
         
         logger.info(f"Matrice créée: {matrix.shape[0]} utilisateurs x {matrix.shape[1]} produits")
         logger.info(f"Nombre d'interactions: {matrix.nnz}")
@@ -127,18 +147,23 @@ def prepare_sparse_matrix(data):
         logger.error(f"Erreur lors de la création de la matrice: {str(e)}")
         raise
 
+def fit_collaborative_model(matrix, n_neighbors=N_NEIGHBORS):
+    """Entraîne le modèle de similarité collaborative (KNN cosinus entre utilisateurs)"""
+    cf_model = NearestNeighbors(
+        metric='cosine', 
+        algorithm='brute', 
+        n_neighbors=n_neighbors
+    )
+    cf_model.fit(matrix)
+    return cf_model
+
 def train_hybrid_model(matrix, product_info):
     """Entraîne un modèle hybride KNN + contenu"""
     logger.info("Entraînement du modèle hybride...")
     
     try:
         # Modèle de similarité collaborative
-        cf_model = NearestNeighbors(
-            metric='cosine', 
-            algorithm='brute', 
-            n_neighbors=20
-        )
-        cf_model.fit(matrix)
+        cf_model = fit_collaborative_model(matrix)
         logger.info("Modèle collaboratif entraîné")
         
         # Modèle de similarité basé sur le contenu (TF-IDF sur les noms de produits)
@@ -157,6 +182,8 @@ def train_hybrid_model(matrix, product_info):
         # Sauvegarde de la matrice sparse
         save_npz(os.path.join(MODEL_DIR, 'interaction_matrix.npz'), matrix)
         
+        load_hybrid_model.cache_clear()
+        _product_map_aisles.cache_clear()
         logger.info("Modèle hybride sauvegardé")
         
         return cf_model, tfidf, tfidf_matrix
@@ -165,57 +192,217 @@ def train_hybrid_model(matrix, product_info):
         logger.error(f"Erreur lors de l'entraînement: {str(e)}")
         raise
 
-def hybrid_recommendations(user_id, user_map, matrix, n=10):
+@lru_cache(maxsize=1)
+def load_hybrid_model():
+    """Charge (une seule fois par processus) les artefacts du modèle hybride"""
+    artifacts = load(os.path.join(MODEL_DIR, 'hybrid_model.joblib'))
+    artifacts['product_index'] = artifacts['product_info'].set_index('product_id')
+    return artifacts
+
+def load_mappings():
+    """Ouvre les correspondances utilisateur/produit en mémoire mappée"""
+    return {
+        'user_map': IdMapping.load(os.path.join(MODEL_DIR, USER_IDS_FILE)),
+        'product_map': IdMapping.load(os.path.join(MODEL_DIR, PRODUCT_IDS_FILE))
+    }
+
+def column_aisles(column_ids, product_index):
+    """Rayon de chaque colonne de la matrice, pour la diversification"""
+    return product_index['aisle'].reindex(column_ids).to_numpy()
+
+@lru_cache(maxsize=1)
+def _product_map_aisles(product_map):
+    """column_aisles pour une correspondance produits, calculé une fois par correspondance chargée"""
+    return column_aisles(np.asarray(product_map.ids), load_hybrid_model()['product_index'])
+
+def collaborative_scores(user_rows, cf_model, matrix):
+    """Scores produits (lignes denses) pour un lot d'utilisateurs via leurs voisins KNN"""
+    user_rows = np.asarray(user_rows)
+    
+    # Un voisin de plus, car l'utilisateur interrogé est son propre plus proche voisin
+    n_neighbors = min(cf_model.n_neighbors + 1, matrix.shape[0])
+    distances, indices = cf_model.kneighbors(matrix[user_rows], n_neighbors=n_neighbors)
+    
+    # On écarte l'utilisateur lui-même pour ne pas sur-pondérer ses propres achats;
+    # s'il est absent (ex aequo à distance nulle), on écarte le voisin le plus lointain
+    is_self = indices == user_rows[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    similarities = np.where(is_self, 0.0, np.clip(1.0 - distances, 0.0, None))
+    
+    # Somme des lignes des voisins pondérée par leur similarité, en un seul produit sparse
+    n_rows, k = indices.shape
+    weights = csr_matrix(
+        (similarities.ravel(), (np.repeat(np.arange(n_rows), k), indices.ravel())),
+        shape=(n_rows, matrix.shape[0]))
+    scores = (weights @ matrix).toarray()
+    
+    norm = similarities.sum(axis=1, keepdims=True)
+    np.divide(scores, norm, out=scores, where=norm > 0)
+    return scores
+
+def _rank_candidates(scores, aisles, n):
+    """Top-n colonnes d'une ligne de scores, diversifiées par rayon"""
+    n_candidates = min(n * 2, scores.shape[0])  # Prendre plus que nécessaire pour filtrer
+    candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+    candidates = candidates[scores[candidates] > 0]
+    
+    # Diversification (éviter trop de produits similaires)
+    unique_aisles = set()
+    selected = []
+    for col in candidates:
+        aisle = aisles[col]
+        if aisle not in unique_aisles or len(unique_aisles) >= 5:
+            selected.append(col)
+            unique_aisles.add(aisle)
+            if len(selected) >= n:
+                break
+    
+    return np.asarray(selected, dtype=np.int64)
+
+def top_n_columns(rows, cf_model, matrix, aisles, n, diversify=True):
+    """Top-n colonnes et scores pour un lot d'utilisateurs (-1 marque une case vide)"""
+    scores = collaborative_scores(rows, cf_model, matrix)
+    top_columns = np.full((len(rows), n), -1, dtype=np.int64)
+    
+    if diversify:
+        for offset in range(len(rows)):
+            selected = _rank_candidates(scores[offset], aisles, n)
+            top_columns[offset, :len(selected)] = selected
+    else:
+        # Sans diversification, le top-n est entièrement vectorisé
+        width = min(n, scores.shape[1])
+        candidates = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+        order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        top_columns[:, :width] = np.where(
+            np.take_along_axis(scores, candidates, axis=1) > 0, candidates, -1)
+    
+    top_scores = np.where(
+        top_columns >= 0, np.take_along_axis(scores, np.maximum(top_columns, 0), axis=1), 0.0)
+    return top_columns, top_scores
+
+def _describe_products(product_ids, scores, product_index):
+    """Formate une liste de produits recommandés pour la réponse JSON"""
+    details = product_index.loc[product_ids]
+    return [
+        {
+            'product_id': int(pid),
+            'product_name': name,
+            'aisle': aisle,
+            'score': float(score)
+        }
+        for pid, name, aisle, score in zip(
+            product_ids, details['product_name'], details['aisle'], scores)
+    ]
+
+def recommend_row(user_idx, cf_model, matrix, column_ids, aisles, product_index, n, diversify=True):
+    """Recommandations en ligne pour une ligne de la matrice (chemin servi par l'API)"""
+    # Scores collaboratifs, diversification puis correspondance colonne -> ID produit
+    columns, scores = top_n_columns([user_idx], cf_model, matrix, aisles, n, diversify=diversify)
+    filled = columns[0] >= 0
+    return _describe_products(column_ids[columns[0, filled]], scores[0, filled], product_index)
+
+def hybrid_recommendations(user_id, user_map, product_map, matrix, n=10):
     """Génère des recommandations hybrides pour un utilisateur"""
     try:
         # Charger le modèle hybride
-        artifacts = load(os.path.join(MODEL_DIR, 'hybrid_model.joblib'))
+        artifacts = load_hybrid_model()
         cf_model = artifacts['cf_model']
-        product_info = artifacts['product_info']
+        product_index = artifacts['product_index']
         
         # Vérifier si l'utilisateur existe
-        if user_id not in user_map:
+        user_idx = user_map.position(user_id)
+        if user_idx < 0:
             return {'success': False, 'message': 'User not found'}
         
-        user_idx = user_map[user_id]
+        return {
+            'success': True,
+            'recommendations': recommend_row(
+                user_idx, cf_model, matrix, np.asarray(product_map.ids),
+                _product_map_aisles(product_map), product_index, n)
+        }
+    
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+
+def precompute_recommendations(matrix, user_map, product_map, n=TOP_N, batch_size=PRECOMPUTE_BATCH_SIZE):
+    """Précalcule le top-n de chaque utilisateur dans des tableaux denses (utilisateurs x n)"""
+    logger.info(f"Précalcul du top-{n} pour {len(user_map)} utilisateurs...")
+    
+    try:
+        artifacts = load_hybrid_model()
+        cf_model = artifacts['cf_model']
+        column_ids = np.asarray(product_map.ids)
+        aisles = _product_map_aisles(product_map)
         
-        # 1. Recommandations collaboratives
-        distances, indices = cf_model.kneighbors(matrix[user_idx])
+        # Les lignes suivent l'ordre de la matrice (user_map); -1 marque une case vide
+        top_products = np.full((matrix.shape[0], n), -1, dtype=np.int32)
+        top_scores = np.zeros((matrix.shape[0], n), dtype=np.float16)
         
-        # Obtenir les IDs des produits recommandés
-        product_ids = [list(product_map.keys())[list(product_map.values()).index(i)] for i in indices[0]]
+        for start in range(0, matrix.shape[0], batch_size):
+            rows = np.arange(start, min(start + batch_size, matrix.shape[0]))
+            columns, scores = top_n_columns(rows, cf_model, matrix, aisles, n)
+            top_products[rows] = np.where(columns >= 0, column_ids[np.maximum(columns, 0)], -1)
+            top_scores[rows] = scores
         
-        # 2. Fusion avec similarité de contenu
-        recommendations = []
-        for pid in product_ids[:n*2]:  # Prendre plus que nécessaire pour filtrer
-            product = product_info[product_info['product_id'] == pid].iloc[0]
-            recommendations.append({
-                'product_id': int(pid),
-                'product_name': product['product_name'],
-                'aisle': product['aisle'],
-                'score': 1.0  # Score initial basé sur CF
-            })
-        
-        # 3. Diversification (éviter trop de produits similaires)
-        unique_aisles = set()
-        final_recommendations = []
+        # Empreinte retirée d'abord et réécrite en dernier: une écriture interrompue
+        # laisse une table sans empreinte, donc ignorée au chargement
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        user_ids_path = os.path.join(MODEL_DIR, TOP_N_USER_IDS_FILE)
+        if os.path.exists(user_ids_path):
+            os.remove(user_ids_path)
+        save_npy_atomic(os.path.join(MODEL_DIR, TOP_N_PRODUCTS_FILE), top_products)
+        save_npy_atomic(os.path.join(MODEL_DIR, TOP_N_SCORES_FILE), top_scores)
+        save_npy_atomic(user_ids_path, np.asarray(user_map.ids, dtype=np.int32))
         
-        for rec in sorted(recommendations, key=lambda x: -x['score']):
-            if rec['aisle'] not in unique_aisles or len(unique_aisles) >= 5:
-                final_recommendations.append(rec)
-                unique_aisles.add(rec['aisle'])
-                if len(final_recommendations) >= n:
-                    break
+        logger.info(f"Table top-{n} sauvegardée ({top_products.nbytes + top_scores.nbytes} octets)")
         
-        return {'success': True, 'recommendations': final_recommendations}
+        return top_products, top_scores
     
     except Exception as e:
-        return {'success': False, 'message': str(e)}
+        logger.error(f"Erreur lors du précalcul: {str(e)}")
+        raise
+
+def load_precomputed_recommendations(user_map):
+    """Ouvre la table top-n précalculée en mémoire mappée, ou None si absente ou périmée"""
+    paths = [os.path.join(MODEL_DIR, name)
+             for name in (TOP_N_PRODUCTS_FILE, TOP_N_SCORES_FILE, TOP_N_USER_IDS_FILE)]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    
+    top_products, top_scores, table_user_ids = (np.load(path, mmap_mode='r') for path in paths)
+    
+    # Une table écrite pour un autre entraînement renverrait la ligne d'un autre utilisateur
+    if top_products.shape != top_scores.shape or not np.array_equal(table_user_ids, user_map.ids):
+        logger.warning(f"Table top-n ignorée: formes {top_products.shape}/{top_scores.shape}, "
+                       f"IDs utilisateurs différents de la correspondance chargée")
+        return None
+    return top_products, top_scores
+
+def precomputed_recommendations(user_id, user_map, table, n=TOP_N):
+    """Lit les recommandations d'un utilisateur dans la table précalculée (None si absent)"""
+    if table is None:
+        return None
+    
+    top_products, top_scores = table
+    row = user_map.position(user_id)
+    if row < 0 or n != top_products.shape[1]:
+        return None
+    
+    product_ids = np.asarray(top_products[row])
+    filled = product_ids >= 0
+    
+    return {
+        'success': True,
+        'recommendations': _describe_products(
+            product_ids[filled], np.asarray(top_scores[row])[filled], load_hybrid_model()['product_index'])
+    }
 
 def content_based_recommendations(product_name, n=10):
     """Recommandations basées sur le contenu pour un produit"""
     try:
-        artifacts = load(os.path.join(MODEL_DIR, 'hybrid_model.joblib'))
+        artifacts = load_hybrid_model()
         tfidf = artifacts['tfidf']
         tfidf_matrix = artifacts['tfidf_matrix']
         product_info = artifacts['product_info']
@@ -262,16 +449,17 @@ def main():
         # Entraînement du modèle
         train_hybrid_model(matrix, product_info)
         
-        # Sauvegarde des mappings
-        dump({
-            'user_map': user_map,
-            'product_map': product_map
-        }, os.path.join(MODEL_DIR, 'mappings.joblib'))
+        # Sauvegarde des mappings (tableaux bruts memory-mappables)
+        user_map.save(os.path.join(MODEL_DIR, USER_IDS_FILE))
+        product_map.save(os.path.join(MODEL_DIR, PRODUCT_IDS_FILE))
+        
+        # Précalcul des recommandations servies par l'API
+        precompute_recommendations(matrix, user_map, product_map)
         
         # Exemple de recommandation
-        sample_user = next(iter(user_map.keys()))
+        sample_user = int(user_map.ids[0])
         logger.info(f"\nExemple de recommandation pour l'utilisateur {sample_user}:")
-        print(json.dumps(hybrid_recommendations(sample_user, user_map, matrix), indent=2))
+        print(json.dumps(hybrid_recommendations(sample_user, user_map, product_map, matrix), indent=2))
         
         sample_product = product_info.iloc[0]['product_name']
         logger.info(f"\nExemple de recommandation pour le produit '{sample_product}':")
@@ -279,17 +467,23 @@ def main():
         
     except Exception as e:
         logger.error(f"Erreur dans le main: {str(e)}")
+        sys.exit(1)  # Code non nul pour que le job d'entraînement soit signalé en échec
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         # Mode API
         try:
-            mappings = load(os.path.join(MODEL_DIR, 'mappings.joblib'))
+            mappings = load_mappings()
             matrix = load_npz(os.path.join(MODEL_DIR, 'interaction_matrix.npz'))
             
             if sys.argv[1] == '--user':
                 user_id = int(sys.argv[2])
-                result = hybrid_recommendations(user_id, mappings['user_map'], matrix)
+                result = hybrid_recommendations(user_id, mappings['user_map'], mappings['product_map'], matrix)
+            elif sys.argv[1] == '--precompute':
+                n = int(sys.argv[2]) if len(sys.argv) > 2 else TOP_N
+                top_products, _ = precompute_recommendations(
+                    matrix, mappings['user_map'], mappings['product_map'], n=n)
+                result = {'success': True, 'users': int(top_products.shape[0]), 'n': n}
             else:
                 product_name = " ".join(sys.argv[1:])
                 result = content_based_recommendations(product_name)
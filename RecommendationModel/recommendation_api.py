@@ -1,44 +1,140 @@
 import sys
 import os
+import importlib
+import time
+import logging
+import threading
 from flask import Flask, request, jsonify
 
-from joblib import load
-from scipy.sparse import load_npz
+_import_started = time.perf_counter()
 
 # Ensure current directory is in the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Now import from recommandation.py
-from recommandation import content_based_recommendations, hybrid_recommendations
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Print current working directory and files for debugging
-print(f"Current working directory: {os.getcwd()}")
-print(f"Files in directory: {os.listdir('.')}")
-print(f"Files in model directory: {os.listdir('model') if os.path.exists('model') else 'model dir not found'}")
+# Répertoire des artefacts, configurable pour les conteneurs
+# (exporté pour que recommandation.py, importé plus tard, utilise le même)
+MODEL_DIR = os.environ.setdefault('MODEL_DIR', 'model')
+
+# État du service, rempli par le thread de chargement en arrière-plan
+_ready = threading.Event()
+_state = {'status': 'loading', 'message': None, 'startup': {}}
+_artifacts = {}
+
+
+def _load_artifacts():
+    """Importe les dépendances lourdes, charge les artefacts puis lance un warm-up"""
+    timings = {'app_import': _app_import_time}
+
+    def timed(step, func):
+        started = time.perf_counter()
+        result = func()
+        timings[step] = round(time.perf_counter() - started, 4)
+        return result
+
+    try:
+        logger.info(f"Chargement des artefacts depuis {os.path.abspath(MODEL_DIR)}")
+
+        # Imports lourds (pandas, scikit-learn, scipy) hors du chemin critique
+        recommandation = timed('imports', lambda: importlib.import_module('recommandation'))
+        from scipy.sparse import load_npz
+
+        mappings = timed('mappings', recommandation.load_mappings)
+        matrix = timed('interaction_matrix', lambda: load_npz(os.path.join(MODEL_DIR, 'interaction_matrix.npz')))
+        table = timed('precomputed_table',
+                      lambda: recommandation.load_precomputed_recommendations(mappings['user_map']))
+        timed('hybrid_model', recommandation.load_hybrid_model)
+
+        _artifacts.update({
+            'recommandation': recommandation,
+            'mappings': mappings,
+            'interaction_matrix': matrix,
+            'precomputed_table': table,
+        })
+
+        # Warm-up: une requête de chaque type pour que la première requête réelle soit à chaud
+        def warm_up():
+            sample_user = int(mappings['user_map'].ids[0])
+            _recommend_user(sample_user, recommandation.TOP_N)
+            _recommend_user(sample_user, recommandation.TOP_N + 1)
+            product_info = recommandation.load_hybrid_model()['product_info']
+            recommandation.content_based_recommendations(product_info.iloc[0]['product_name'])
+
+        timed('warm_up', warm_up)
+
+        timings['total'] = round(time.perf_counter() - _import_started, 4)
+        _state.update({'status': 'ready', 'startup': timings})
+        _ready.set()
+        logger.info(f"Service prêt, démarrage (s): {timings}")
+
+    except Exception as e:
+        _state.update({'status': 'failed', 'message': str(e), 'startup': timings})
+        logger.error(f"Erreur lors du chargement des artefacts: {str(e)}")
+
+
+def _recommend_user(user_id, n):
+    """Lecture dans la table précalculée, calcul en ligne sinon"""
+    recommandation = _artifacts['recommandation']
+    mappings = _artifacts['mappings']
+
+    # Lecture O(1) dans la table précalculée; calcul en ligne sinon
+    recommendations = recommandation.precomputed_recommendations(
+        user_id, mappings['user_map'], _artifacts['precomputed_table'], n=n)
+    if recommendations is None:
+        recommendations = recommandation.hybrid_recommendations(
+            user_id, mappings['user_map'], mappings['product_map'], _artifacts['interaction_matrix'], n=n)
+    return recommendations
+
+
+def _not_ready():
+    return jsonify({'success': False, 'message': f"Model {_state['status']}"}), 503
+
+
+_app_import_time = round(time.perf_counter() - _import_started, 4)
+threading.Thread(target=_load_artifacts, name='model-loader', daemon=True).start()
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'success': True, 'status': 'alive'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    body = {'success': _ready.is_set(), **_state}
+    return jsonify(body), 200 if _ready.is_set() else 503
 
-# Charger les artefacts nécessaires
-MODEL_DIR = 'model'
-mappings = load(os.path.join(MODEL_DIR, 'mappings.joblib'))
-interaction_matrix = load_npz(os.path.join(MODEL_DIR, 'interaction_matrix.npz'))
 
 @app.route('/recommend/user', methods=['POST'])
 def recommend_for_user():
+    if not _ready.is_set():
+        return _not_ready()
+
     data = request.json
     user_id = data.get('user_id')
+    n = data.get('n', _artifacts['recommandation'].TOP_N)
 
     if not user_id:
         return jsonify({'success': False, 'message': 'User ID is required'}), 400
 
+    if not isinstance(n, int) or isinstance(n, bool) or n <= 0:
+        return jsonify({'success': False, 'message': 'n must be a positive integer'}), 400
+    n = min(n, len(_artifacts['mappings']['product_map']))
+
     try:
-        recommendations = hybrid_recommendations(user_id, mappings['user_map'], interaction_matrix)
-        return jsonify(recommendations)
+        return jsonify(_recommend_user(user_id, n))
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/recommend/product', methods=['POST'])
 def recommend_for_product():
+    if not _ready.is_set():
+        return _not_ready()
+
     data = request.json
     product_name = data.get('product_name')
 
@@ -46,10 +142,11 @@ def recommend_for_product():
         return jsonify({'success': False, 'message': 'Product name is required'}), 400
 
     try:
-        recommendations = content_based_recommendations(product_name)
+        recommendations = _artifacts['recommandation'].content_based_recommendations(product_name)
         return jsonify(recommendations)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 if __name__ == '__main__':
-    # Listen on all network interfaces (0.0.0.0) instead of just localhost
\ No newline at end of file
+    # Listen on all network interfaces (0.0.0.0) instead of just localhost
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import csr_matrix
+
+from evaluation import ranking_metrics, split_last_order
+
+
+def naive_metrics(recommended, relevant, n_relevant, n_products):
+    """Référence en boucle Python, utilisateur par utilisateur"""
+    relevant = relevant.toarray()
+    n_users, k = recommended.shape
+    precision = recall = average_precision = 0.0
+    for user in range(n_users):
+        hits = [col >= 0 and relevant[user, col] > 0 for col in recommended[user]]
+        precision += sum(hits) / k
+        recall += sum(hits) / n_relevant[user]
+        found, score = 0, 0.0
+        for rank, hit in enumerate(hits, start=1):
+            if hit:
+                found += 1
+                score += found / rank
+        average_precision += score / min(n_relevant[user], k)
+    return {
+        'precision_at_k': precision / n_users,
+        'recall_at_k': recall / n_users,
+        'map_at_k': average_precision / n_users,
+        'coverage': len(set(recommended[recommended >= 0].tolist())) / n_products,
+    }
+
+
+def test_ranking_metrics_hand_computed():
+    # Utilisateur 0: succès aux rangs 1 et 3; utilisateur 1: aucun succès, liste complétée par -1
+    recommended = np.array([[0, 1, 2], [3, -1, -1]])
+    relevant = csr_matrix(np.array([[1, 0, 1, 0, 0], [0, 0, 0, 0, 1]], dtype=np.int8))
+    n_relevant = np.array([2, 1])
+
+    metrics = ranking_metrics(recommended, relevant, n_relevant, n_products=5)
+
+    assert metrics['precision_at_k'] == pytest.approx((2 / 3 + 0) / 2)
+    assert metrics['recall_at_k'] == pytest.approx((1 + 0) / 2)
+    assert metrics['map_at_k'] == pytest.approx(((1 + 2 / 3) / 2 + 0) / 2)
+    assert metrics['coverage'] == pytest.approx(4 / 5)
+
+
+def test_padding_never_counts_as_hit():
+    # La colonne 0 est pertinente: un -1 ramené à 0 pour l'indexation ne doit pas compter
+    recommended = np.array([[-1, -1]])
+    relevant = csr_matrix(np.array([[1, 0]], dtype=np.int8))
+
+    metrics = ranking_metrics(recommended, relevant, np.array([1]), n_products=2)
+
+    assert metrics == {'precision_at_k': 0.0, 'recall_at_k': 0.0, 'map_at_k': 0.0, 'coverage': 0.0}
+
+
+def test_ranking_metrics_matches_naive_loop():
+    rng = np.random.default_rng(0)
+    n_users, n_products, k = 60, 30, 5
+    relevant = csr_matrix((rng.random((n_users, n_products)) < 0.15).astype(np.int8))
+    # Produits pertinents inconnus de l'entraînement: n_relevant peut dépasser la matrice
+    n_relevant = np.maximum(relevant.getnnz(axis=1), 1) + rng.integers(0, 2, n_users)
+    recommended = np.array([rng.permutation(n_products)[:k] for _ in range(n_users)])
+    recommended[::4, 3:] = -1
+
+    metrics = ranking_metrics(recommended, relevant, n_relevant, n_products)
+    expected = naive_metrics(recommended, relevant, n_relevant, n_products)
+
+    assert metrics == pytest.approx(expected)
+
+
+def test_split_last_order_holds_out_each_users_last_order():
+    data = pd.DataFrame({
+        'user_id': [1, 1, 1, 2, 2],
+        'order_number': [1, 2, 2, 1, 3],
+        'product_id': [10, 11, 12, 10, 13],
+    })
+
+    train, holdout = split_last_order(data)
+
+    assert sorted(zip(holdout['user_id'], holdout['product_id'])) == [(1, 11), (1, 12), (2, 13)]
+    assert sorted(zip(train['user_id'], train['product_id'])) == [(1, 10), (2, 10)]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from id_mapping import IdMapping
+
+
+@pytest.fixture
+def mapping():
+    # Doublons et désordre: les positions suivent l'ordre trié [3, 7, 42]
+    return IdMapping.from_ids([42, 7, 3, 7])
+
+
+def test_from_ids_sorts_and_deduplicates(mapping):
+    assert mapping.ids.dtype == np.int32
+    assert list(mapping.ids) == [3, 7, 42]
+    assert len(mapping) == 3
+
+
+def test_position_known_and_unknown_ids(mapping):
+    assert mapping.position(3) == 0
+    assert mapping.position(42) == 2
+    assert mapping.position(5) == -1
+    assert mapping.position(100) == -1
+    assert mapping[7] == 1
+    with pytest.raises(KeyError):
+        mapping[5]
+
+
+def test_position_numpy_and_python_ints_match(mapping):
+    for id_type in (int, np.int32, np.int64, np.uint16):
+        assert mapping.position(id_type(7)) == 1
+        assert id_type(7) in mapping
+
+
+def test_position_rejects_non_integers_and_out_of_range(mapping):
+    for id_ in (True, False, np.bool_(True), '7', 7.0, None, 2**31, -2**31 - 1, 10**30):
+        assert mapping.position(id_) == -1
+        assert id_ not in mapping
+
+
+def test_positions_batch(mapping):
+    positions = mapping.positions(np.array([42, 5, 3, 2**40, -1, 7]))
+    assert list(positions) == [2, -1, 0, -1, -1, 1]
+    assert list(mapping.positions([True, False])) == [-1, -1]
+
+
+def test_empty_mapping():
+    empty = IdMapping.from_ids([])
+    assert len(empty) == 0
+    assert empty.position(1) == -1
+    assert 1 not in empty
+    assert list(empty.positions([1, 2])) == [-1, -1]
+
+
+def test_save_and_load_memory_mapped(mapping, tmp_path):
+    path = tmp_path / 'ids.npy'
+    mapping.save(str(path))
+    loaded = IdMapping.load(str(path))
+    assert isinstance(loaded.ids, np.memmap)
+    assert loaded.position(42) == 2
+
+    # Réécriture pendant que l'ancien fichier est mappé: l'ancienne vue reste lisible
+    IdMapping.from_ids([1, 2]).save(str(path))
+    assert list(loaded.ids) == [3, 7, 42]
+    assert list(IdMapping.load(str(path)).ids) == [1, 2]
+    assert [p.name for p in tmp_path.iterdir()] == ['ids.npy']
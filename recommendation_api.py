@@ -1,36 +1,101 @@
 import os
+import time
+import logging
+import threading
 from flask import Flask, request, jsonify
-from joblib import load
-import pandas as pd
+
+_import_started = time.perf_counter()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Définir le répertoire des modèles correctement
-MODEL_DIR = 'C:/Users/pc/Desktop/Sinda pi 2/Novastackers/model'  # Mets à jour ce chemin si nécessaire
+# Définir le répertoire des modèles (configurable via la variable d'environnement MODEL_DIR)
+MODEL_DIR = os.environ.get('MODEL_DIR', 'model')
+
+# État du service, rempli par le thread de chargement en arrière-plan
+_ready = threading.Event()
+_state = {'status': 'loading', 'message': None, 'startup': {}}
+_artifacts = {}
+
+
+def _load_artifacts():
+    """Importe les dépendances lourdes, charge les artefacts de segmentation puis lance un warm-up"""
+    timings = {'app_import': _app_import_time}
+
+    def timed(step, func):
+        started = time.perf_counter()
+        result = func()
+        timings[step] = round(time.perf_counter() - started, 4)
+        return result
+
+    try:
+        logger.info(f"Chargement des modèles depuis {os.path.abspath(MODEL_DIR)}")
+
+        # Imports lourds hors du chemin critique (pandas est ensuite réutilisé par _segment)
+        def imports():
+            import pandas  # noqa: F401
+            from joblib import load
+            return load
+
+        load = timed('imports', imports)
+
+        # Chargement des artefacts de segmentation
+        _artifacts['segmentation_model'] = timed(
+            'segmentation_model', lambda: load(os.path.join(MODEL_DIR, 'segmentation_model.joblib')))
+        _artifacts['scaler'] = timed('scaler', lambda: load(os.path.join(MODEL_DIR, 'scaler.joblib')))
+        _artifacts['features'] = timed('features', lambda: load(os.path.join(MODEL_DIR, 'features.joblib')))
+
+        # Warm-up: une prédiction factice pour que la première requête réelle soit à chaud
+        timed('warm_up', lambda: _segment({feature: 0 for feature in _artifacts['features']}))
+
+        timings['total'] = round(time.perf_counter() - _import_started, 4)
+        _state.update({'status': 'ready', 'startup': timings})
+        _ready.set()
+        logger.info(f"Service prêt, démarrage (s): {timings}")
+
+    except Exception as e:
+        _state.update({'status': 'failed', 'message': str(e), 'startup': timings})
+        logger.error(f"Erreur lors du chargement des modèles: {e}")
+
+
+def _segment(data):
+    import pandas as pd  # Déjà chargé par _load_artifacts
+
+    df = pd.DataFrame([data])  # Une seule instance par appel
+    X_scaled = _artifacts['scaler'].transform(df[_artifacts['features']])
+    return int(_artifacts['segmentation_model'].predict(X_scaled)[0])
+
+
+_app_import_time = round(time.perf_counter() - _import_started, 4)
+threading.Thread(target=_load_artifacts, name='model-loader', daemon=True).start()
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'success': True, 'status': 'alive'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    body = {'success': _ready.is_set(), **_state}
+    return jsonify(body), 200 if _ready.is_set() else 503
 
-try:
-    # Chargement des artefacts de segmentation
-    segmentation_model = load(os.path.join(MODEL_DIR, 'segmentation_model.joblib'))
-    scaler = load(os.path.join(MODEL_DIR, 'scaler.joblib'))
-    features = load(os.path.join(MODEL_DIR, 'features.joblib'))
-except FileNotFoundError as e:
-    print(f"Erreur lors du chargement des modèles: {e}")
-    exit(1)  # Quitter le programme si les fichiers ne sont pas trouvés
 
 @app.route('/segment', methods=['POST'])
 def segment_data():
+    if not _ready.is_set():
+        return jsonify({'success': False, 'message': f"Model {_state['status']}"}), 503
+
     data = request.json
 
     try:
-        df = pd.DataFrame([data])  # Une seule instance par appel
-        missing = [col for col in features if col not in df.columns]
+        missing = [col for col in _artifacts['features'] if col not in data]
         if missing:
             return jsonify({'success': False, 'message': f'Missing features: {missing}'}), 400
 
-        X_scaled = scaler.transform(df[features])
-        segment = segmentation_model.predict(X_scaled)[0]
-
-        return jsonify({'success': True, 'segment': int(segment)})
+        return jsonify({'success': True, 'segment': _segment(data)})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 